@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from werkzeug.utils import secure_filename
+
+from pdf_ocr import (
+    process_document, OCRProcessingError, AdaptiveConcurrencyLimiter, file_size_mb,
+    _is_transient_error, _root_cause,
+)
+
+
+class LeaseLostError(Exception):
+    """Raised when the coordinator no longer recognises a lease."""
+
+
+class CoordinatorClient:
+    """与 webui 协调节点通信的 HTTP 客户端"""
+
+    def __init__(self, base_url: str, token: str = None, timeout: float = 30.0):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, data=None, headers: dict = None):
+        req = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method)
+        if self.token:
+            req.add_header('Authorization', f'Bearer {self.token}')
+        for key, value in (headers or {}).items():
+            req.add_header(key, value)
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise LeaseLostError(f"租约已失效: {path}") from e
+            raise
+
+    def lease(self):
+        with self._request('POST', '/worker/lease') as resp:
+            if resp.status == 204:
+                return None
+            return json.load(resp)
+
+    def download(self, lease_id: str, dest_path: str) -> None:
+        with self._request('GET', f'/worker/file/{lease_id}') as resp, open(dest_path, 'wb') as f:
+            shutil.copyfileobj(resp, f)
+
+    def heartbeat(self, lease_id: str) -> None:
+        self._request('POST', f'/worker/heartbeat/{lease_id}').close()
+
+    def upload_result(self, lease_id: str, zip_path: str) -> None:
+        with open(zip_path, 'rb') as f:
+            headers = {
+                'Content-Type': 'application/zip',
+                'Content-Length': str(os.path.getsize(zip_path)),
+            }
+            self._request('POST', f'/worker/result/{lease_id}', data=f, headers=headers).close()
+
+    def report_failure(self, lease_id: str, error: str, retry: bool = False) -> None:
+        data = json.dumps({"error": error, "retry": retry}, ensure_ascii=False).encode('utf-8')
+        self._request('POST', f'/worker/fail/{lease_id}', data=data,
+                      headers={'Content-Type': 'application/json'}).close()
+
+
+def _heartbeat_loop(client: CoordinatorClient, lease_id: str, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            client.heartbeat(lease_id)
+        except LeaseLostError:
+            print(f"租约 {lease_id} 已失效，停止续约")
+            return
+        except Exception as e:
+            print(f"续约失败，稍后重试: {e}")
+
+
+def _zip_directory(src_dir: str, zip_path: str) -> None:
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for root, _, files in os.walk(src_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                zipf.write(file_path, os.path.relpath(file_path, src_dir))
+
+
+def run_job(client: CoordinatorClient, job: dict, limiter: AdaptiveConcurrencyLimiter) -> None:
+    """处理一个已领取的租约：下载源文件、OCR、回传结果。
+
+    调用方已为该租约占用了 limiter 名额，本函数负责归还。
+    """
+    slot_held = True
+    stop = threading.Event()
+    work_dir = tempfile.mkdtemp(prefix='ocr_worker_')
+    try:
+        lease_id = job["lease_id"]
+        threading.Thread(
+            target=_heartbeat_loop,
+            args=(client, lease_id, job["lease_timeout"] / 3, stop),
+            daemon=True,
+        ).start()
+
+        file_path = os.path.join(work_dir, secure_filename(job["file_name"]))
+        out_dir = os.path.join(work_dir, 'output')
+        client.download(lease_id, file_path)
+
+        start = time.monotonic()
+        error = None
+        try:
+            process_document(file_path, out_dir)
+        except Exception as e:
+            error = e
+        finally:
+            limiter.release(time.monotonic() - start, error, file_size_mb(file_path))
+            slot_held = False
+
+        if error is not None:
+            if isinstance(error, (FileNotFoundError, ValueError, OCRProcessingError)):
+                message = str(error)
+            else:
+                message = f"未知错误: {error}"
+            # 限流、服务端错误和连接问题交回协调节点重新排队，其余错误直接判定失败
+            retry = _is_transient_error(_root_cause(error))
+            client.report_failure(lease_id, message, retry=retry)
+            return
+
+        zip_path = os.path.join(work_dir, 'result.zip')
+        _zip_directory(out_dir, zip_path)
+        client.upload_result(lease_id, zip_path)
+        print(f"已完成: {job['file_name']}")
+    except LeaseLostError as e:
+        print(f"{job['file_name']}: {e}")
+    finally:
+        if slot_held:
+            limiter.abandon()
+        stop.set()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def worker_loop(client: CoordinatorClient, limiter: AdaptiveConcurrencyLimiter,
+                poll_interval: float = 2.0) -> None:
+    """不断领取并处理任务；先占用并发名额再领取，避免持有无法处理的租约"""
+    while True:
+        limiter.acquire()
+        try:
+            job = client.lease()
+        except Exception as e:
+            limiter.abandon()
+            print(f"领取任务失败: {e}")
+            time.sleep(poll_interval)
+            continue
+
+        if not job:
+            limiter.abandon()
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            run_job(client, job, limiter)
+        except Exception as e:
+            # 任何异常都不能结束线程；租约到期后协调节点会将文件重新排队
+            print(f"处理任务 {job.get('file_name') if isinstance(job, dict) else job} 失败: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式 OCR worker：从 webui 协调节点领取并处理文件。")
+    parser.add_argument(
+        "--coordinator", default="http://localhost:8080",
+        help="协调节点（webui）地址，默认为 http://localhost:8080。"
+    )
+    parser.add_argument(
+        "--token", default=os.environ.get("OCR_WORKER_TOKEN"),
+        help="与协调节点 OCR_WORKER_TOKEN 一致的令牌，默认读取同名环境变量。"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=2, help="本 worker 同时处理的最大文件数。")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="队列为空时的轮询间隔（秒）。")
+
+    args = parser.parse_args()
+
+    client = CoordinatorClient(args.coordinator, args.token)
+    limiter = AdaptiveConcurrencyLimiter(
+        min_limit=1, max_limit=args.concurrency, initial_limit=args.concurrency
+    )
+    print(f"worker 已启动，协调节点: {args.coordinator}，并发: {args.concurrency}")
+
+    for _ in range(args.concurrency):
+        threading.Thread(
+            target=worker_loop, args=(client, limiter, args.poll_interval), daemon=True
+        ).start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
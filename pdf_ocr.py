@@ -2,7 +2,13 @@ from pathlib import Path
 import os
 import base64
 import sys
+import json
+import time
+import tempfile
 import argparse
+import threading
+from collections import deque
+from contextlib import contextmanager
 
 # mistralai 2.x 优先，回退到 1.x
 try:
@@ -43,10 +49,176 @@ IMAGE_MIME_TYPES = {
 }
 
 
+OCR_MODEL = "mistral-ocr-latest"
+
+# 批处理任务的终态
+BATCH_TERMINAL_STATUSES = {'SUCCESS', 'FAILED', 'TIMEOUT_EXCEEDED', 'CANCELLED'}
+
+
 class OCRProcessingError(Exception):
     """Raised when an OCR processing step fails."""
 
 
+def _is_connection_error(e: Exception) -> bool:
+    """连接失败或超时（未收到 HTTP 响应）"""
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    if MistralConnectionException is not Exception and isinstance(e, MistralConnectionException):
+        return True
+    # 与 SDK 的重试逻辑一致，按名称识别 httpx 的传输层异常
+    return any(cls.__name__ in ('NetworkError', 'TimeoutException') for cls in type(e).__mro__)
+
+
+def _is_transient_error(e: Exception) -> bool:
+    """可重试的错误：限流、服务端错误或连接问题"""
+    status_code = getattr(e, "status_code", None)
+    if status_code == 429 or (status_code is not None and status_code >= 500):
+        return True
+    return _is_connection_error(e)
+
+
+def _root_cause(e: Exception) -> Exception:
+    while e.__cause__ is not None:
+        e = e.__cause__
+    return e
+
+
+class AdaptiveConcurrencyLimiter:
+    """按 AIMD 策略自动调整同时进行的 API 调用数。
+
+    名额用满时每次成功调用使上限加性增长（约每轮增加 1），未用满时不增长；
+    遇到 429/5xx、连接失败或超时，
+    或单位耗时（秒/MB）超过移动基线的 latency_tolerance 倍时上限减半，两次减半
+    之间至少间隔 cooldown 秒。其他失败（如 401 等 4xx）不调整上限。
+    """
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 20, initial_limit: int = 5,
+                 latency_tolerance: float = 3.0, baseline_alpha: float = 0.1, warmup: int = 5,
+                 min_size_mb: float = 0.1, cooldown: float = 5.0, history_size: int = 50):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("并发上限配置无效：需满足 1 <= min_limit <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.baseline_alpha = baseline_alpha
+        self.warmup = warmup
+        self.min_size_mb = min_size_mb
+        self.cooldown = cooldown
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease = None
+        self._baseline = None  # 成功调用的单位耗时（秒/MB）的指数移动平均
+        self._samples = 0
+        self._decisions = deque(maxlen=history_size)
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def abandon(self) -> None:
+        """归还名额但不反馈结果（如占用名额后发现任务已取消）"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _overload_reason(self, latency: float, error: Exception, size_mb: float):
+        """返回 (是否成功, 过载原因)"""
+        if error is not None:
+            cause = _root_cause(error)
+            status_code = getattr(cause, "status_code", None)
+            if status_code == 429 or (status_code is not None and status_code >= 500):
+                return False, f"HTTP {status_code}"
+            if _is_connection_error(cause):
+                return False, f"连接失败或超时: {type(cause).__name__}"
+            return False, None
+
+        per_mb = latency / max(size_mb, self.min_size_mb)
+        if self._baseline is not None and self._samples >= self.warmup:
+            if per_mb > self._baseline * self.latency_tolerance:
+                reason = f"耗时 {per_mb:.1f}s/MB 超过基线 {self._baseline:.1f}s/MB 的 {self.latency_tolerance:g} 倍"
+            else:
+                reason = None
+        else:
+            reason = None
+
+        # 基线缓慢跟随实际耗时，API 整体变慢时不会永久压低并发
+        if self._baseline is None:
+            self._baseline = per_mb
+        else:
+            self._baseline += self.baseline_alpha * (per_mb - self._baseline)
+        self._samples += 1
+        return True, reason
+
+    def release(self, latency: float, error: Exception = None, size_mb: float = 1.0) -> None:
+        """归还名额并根据结果调整上限；error 为调用抛出的异常（成功时为 None）"""
+        with self._cond:
+            # 只有上限确实被用满时才说明需要更多名额
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+            old_limit = int(self._limit)
+            now = time.monotonic()
+            succeeded, reason = self._overload_reason(latency, error, size_mb)
+
+            if reason:
+                if self._last_decrease is None or now - self._last_decrease >= self.cooldown:
+                    self._limit = max(float(self.min_limit), self._limit / 2)
+                    self._last_decrease = now
+                    action = "decrease"
+                else:
+                    action = None
+            elif succeeded and saturated:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+                action = "increase"
+                reason = "调用成功"
+            else:
+                action = None
+
+            if action and int(self._limit) != old_limit:
+                self._decisions.append({
+                    "time": time.time(),
+                    "action": action,
+                    "reason": reason,
+                    "limit": int(self._limit),
+                })
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, size_mb: float = 1.0):
+        """占用一个调用名额，并根据耗时与结果调整上限。"""
+        self.acquire()
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(time.monotonic() - start, error, size_mb)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "latency_baseline": self._baseline,
+                "decisions": list(self._decisions),
+            }
+
+
+def file_size_mb(path: str | Path) -> float:
+    return Path(path).stat().st_size / (1024 * 1024)
+
+
 def is_supported_file(path: str | Path) -> bool:
     return Path(path).suffix.lower() in SUPPORTED_EXTENSIONS
 
@@ -61,6 +233,11 @@ def image_to_data_url(image_path: Path) -> str:
     return f"data:{mime};base64,{encoded}"
 
 
+def pdf_to_data_url(pdf_path: Path) -> str:
+    encoded = base64.b64encode(pdf_path.read_bytes()).decode()
+    return f"data:application/pdf;base64,{encoded}"
+
+
 def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
     for img_name, img_path in images_dict.items():
         markdown_str = markdown_str.replace(f"![{img_name}]({img_name})", f"![{img_name}]({img_path})")
@@ -94,6 +271,10 @@ def _create_client() -> Mistral:
     api_key = os.environ.get("MISTRAL_API_KEY")
     if not api_key:
         raise ValueError("MISTRAL_API_KEY 环境变量未设置。")
+    # 可通过 MISTRAL_SERVER_URL 指向本地替身服务进行测试
+    server_url = os.environ.get("MISTRAL_SERVER_URL")
+    if server_url:
+        return Mistral(api_key=api_key, server_url=server_url)
     return Mistral(api_key=api_key)
 
 
@@ -102,7 +283,7 @@ def _run_ocr(client: Mistral, document) -> OCRResponse:
     try:
         return client.ocr.process(
             document=document,
-            model="mistral-ocr-latest",
+            model=OCR_MODEL,
             include_image_base64=True,
         )
     except (MistralAPIException, MistralConnectionException) as e:
@@ -184,18 +365,221 @@ def process_pdf(pdf_path: str, output_dir_arg: str = None) -> None:
     process_document(pdf_path, output_dir_arg)
 
 
+def _build_batch_request(source_file: Path) -> dict:
+    if is_image_file(source_file):
+        document = {"type": "image_url", "image_url": image_to_data_url(source_file)}
+    else:
+        document = {"type": "document_url", "document_url": pdf_to_data_url(source_file)}
+    return {
+        "custom_id": source_file.name,
+        "body": {"document": document, "include_image_base64": True},
+    }
+
+
+def _submit_batch_job(client: Mistral, source_files: list[Path]):
+    print(f"正在生成批处理请求文件，共 {len(source_files)} 个文档...")
+    with tempfile.TemporaryFile() as jsonl:
+        for source_file in source_files:
+            line = json.dumps(_build_batch_request(source_file), ensure_ascii=False)
+            jsonl.write(line.encode('utf-8') + b"\n")
+        jsonl.seek(0)
+
+        print("正在上传批处理请求文件...")
+        try:
+            batch_file = client.files.upload(
+                file={"file_name": "ocr_batch.jsonl", "content": jsonl},
+                purpose="batch",
+            )
+        except (MistralAPIException, MistralConnectionException) as e:
+            raise OCRProcessingError(f"上传批处理文件时发生API或连接错误: {e}") from e
+        except MistralException as e:
+            raise OCRProcessingError(f"上传批处理文件时发生Mistral相关错误: {e}") from e
+        except Exception as e:
+            raise OCRProcessingError(f"上传批处理文件时发生未知错误: {e}") from e
+
+    try:
+        job = client.batch.jobs.create(
+            input_files=[batch_file.id],
+            model=OCR_MODEL,
+            endpoint="/v1/ocr",
+        )
+    except (MistralAPIException, MistralConnectionException) as e:
+        raise OCRProcessingError(f"创建批处理任务时发生API或连接错误: {e}") from e
+    except MistralException as e:
+        raise OCRProcessingError(f"创建批处理任务时发生Mistral相关错误: {e}") from e
+    except Exception as e:
+        raise OCRProcessingError(f"创建批处理任务时发生未知错误: {e}") from e
+
+    print(f"批处理任务已提交，任务ID: {job.id}")
+    return job
+
+
+def _wait_for_batch_job(client: Mistral, job_id: str,
+                        poll_interval: float = 5.0, max_poll_interval: float = 60.0,
+                        max_poll_errors: int = 10):
+    """轮询批处理任务直到结束，轮询间隔按指数退避增长。
+
+    查询时的临时错误（429/5xx、连接失败）会在退避后重试，连续失败超过
+    max_poll_errors 次才放弃；任务仍在服务端运行，可用 --job-id 继续。
+    """
+    interval = poll_interval
+    errors = 0
+    while True:
+        try:
+            job = client.batch.jobs.get(job_id=job_id)
+        except Exception as e:
+            errors += 1
+            if not _is_transient_error(e) or errors > max_poll_errors:
+                raise OCRProcessingError(
+                    f"查询批处理任务 {job_id} 时发生错误: {e}（可使用 --job-id {job_id} 继续）"
+                ) from e
+            print(f"查询批处理任务失败（{e}），{interval:.0f} 秒后重试...")
+        else:
+            errors = 0
+            if job.status in BATCH_TERMINAL_STATUSES:
+                return job
+            print(f"批处理任务状态: {job.status}，{interval:.0f} 秒后重试...")
+
+        time.sleep(interval)
+        interval = min(interval * 2, max_poll_interval)
+
+
+def _iter_batch_results(client: Mistral, job_id: str, file_id: str):
+    """逐行流式读取批处理结果文件，避免整体载入内存。"""
+    resume_hint = f"（可使用 --job-id {job_id} 重新取回结果）"
+    try:
+        response = client.files.download(file_id=file_id)
+    except (MistralAPIException, MistralConnectionException) as e:
+        raise OCRProcessingError(f"下载批处理任务 {job_id} 的结果时发生API或连接错误: {e}{resume_hint}") from e
+    except MistralException as e:
+        raise OCRProcessingError(f"下载批处理任务 {job_id} 的结果时发生Mistral相关错误: {e}{resume_hint}") from e
+    except Exception as e:
+        raise OCRProcessingError(f"下载批处理任务 {job_id} 的结果时发生未知错误: {e}{resume_hint}") from e
+
+    try:
+        lines = response.iter_lines()
+        while True:
+            # 只包装读取过程，调用方处理记录时的异常不经过这里
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise OCRProcessingError(
+                    f"读取批处理任务 {job_id} 的结果时发生错误: {e}{resume_hint}"
+                ) from e
+
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过无法解析的批处理结果行: {e}")
+    finally:
+        response.close()
+
+
+def _batch_output_names(source_files: list[Path]) -> dict:
+    """为每个文档确定输出名称，主文件名相同（如 a.pdf 与 a.png）时改用完整文件名避免覆盖。"""
+    stem_counts = {}
+    for f in source_files:
+        stem_counts[f.stem] = stem_counts.get(f.stem, 0) + 1
+    return {f.name: f.stem if stem_counts[f.stem] == 1 else f.name for f in source_files}
+
+
+def _save_batch_record(record: dict, output_root: str, output_names: dict, results: dict) -> None:
+    name = record.get("custom_id")
+    if name not in results:
+        return
+
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        results[name] = f"OCR处理失败: {record.get('error') or response.get('body')}"
+        return
+
+    try:
+        ocr_response = OCRResponse.model_validate(response.get("body"))
+        output_name = output_names[name]
+        save_ocr_results(ocr_response, os.path.join(output_root, f"ocr_results_{output_name}"), output_name)
+    except Exception as e:
+        results[name] = f"保存OCR结果失败: {e}"
+    else:
+        results[name] = None
+
+
+def process_directory_batch(input_dir: str, output_dir_arg: str = None, job_id: str = None,
+                            poll_interval: float = 5.0, max_poll_interval: float = 60.0) -> dict:
+    """将目录中的所有文档作为一个异步批处理任务提交。
+
+    指定 job_id 时不再提交新任务，而是继续等待并取回已有任务的结果。
+    返回 {文件名: 错误信息或 None}。
+    """
+    source_dir = Path(input_dir)
+    if not source_dir.is_dir():
+        raise FileNotFoundError(f"目录不存在: {input_dir}")
+
+    source_files = sorted(p for p in source_dir.iterdir() if p.is_file() and is_supported_file(p))
+    if not source_files:
+        raise ValueError(f"目录中没有可处理的 PDF 或图片文件: {input_dir}")
+
+    if output_dir_arg:
+        output_root = output_dir_arg
+    else:
+        output_root = f"ocr_results_{source_dir.resolve().name}"
+
+    client = _create_client()
+    if not job_id:
+        job_id = _submit_batch_job(client, source_files).id
+    job = _wait_for_batch_job(client, job_id, poll_interval, max_poll_interval)
+
+    if not job.output_file and not job.error_file:
+        raise OCRProcessingError(f"批处理任务 {job_id} 未返回结果文件，状态: {job.status}")
+
+    print("批处理任务已结束，正在保存结果...")
+    results = {f.name: f"批处理结果中缺少该文件（任务状态: {job.status}）" for f in source_files}
+    output_names = _batch_output_names(source_files)
+    # 成功的请求写入 output_file，失败的请求写入 error_file
+    for file_id in (job.output_file, job.error_file):
+        if not file_id:
+            continue
+        for record in _iter_batch_results(client, job_id, file_id):
+            _save_batch_record(record, output_root, output_names, results)
+
+    failed = sum(1 for error in results.values() if error)
+    print(f"批处理完成：成功 {len(results) - failed} 个，失败 {failed} 个。结果保存在: {output_root}")
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(description="使用 Mistral AI OCR 处理 PDF 或图片文件。")
-    parser.add_argument("file_path", help="要处理的 PDF 或图片文件路径。")
+    parser.add_argument("file_path", help="要处理的 PDF 或图片文件路径（批处理模式下为目录）。")
     parser.add_argument(
         "-o", "--output_dir",
         help="存储结果的输出目录。如果未提供，则默认为 'ocr_results_[文件名]'。"
     )
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="将目录中的所有文档作为一个异步批处理任务提交（成本更低，但不保证时延）。"
+    )
+    parser.add_argument(
+        "--job-id",
+        help="批处理模式下继续等待已提交的批处理任务，而不是重新提交。"
+    )
 
     args = parser.parse_args()
+    if args.job_id and not args.batch:
+        parser.error("--job-id 只能与 --batch 一起使用。")
 
     try:
-        process_document(args.file_path, args.output_dir)
+        if args.batch:
+            results = process_directory_batch(args.file_path, args.output_dir, args.job_id)
+            for name, error in results.items():
+                if error:
+                    print(f"{name}: {error}")
+            if any(results.values()):
+                sys.exit(1)
+        else:
+            process_document(args.file_path, args.output_dir)
     except (FileNotFoundError, ValueError, OCRProcessingError) as e:
         print(f"主程序错误: {e}")
         sys.exit(1)
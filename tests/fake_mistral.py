@@ -0,0 +1,194 @@
+"""本地 Mistral API 替身服务，只实现批处理流程用到的接口。
+
+- POST /v1/files                上传文件（multipart）
+- GET  /v1/files/{id}/content   下载文件内容
+- POST /v1/batch/jobs           创建批处理任务
+- GET  /v1/batch/jobs/{id}      查询批处理任务
+
+任务在被查询 `polls_until_done` 次后结束，每条请求交给 `ocr_handler` 处理：
+返回 (200, body) 的写入 output_file，其余写入 error_file。
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_ocr_handler(custom_id: str, body: dict):
+    return 200, {
+        "pages": [{
+            "index": 0,
+            "markdown": f"# {custom_id}",
+            "images": [],
+            "dimensions": None,
+        }],
+        "model": "mistral-ocr-latest",
+        "usage_info": {"pages_processed": 1},
+    }
+
+
+class FakeMistralServer:
+    def __init__(self, ocr_handler=default_ocr_handler, polls_until_done: int = 2,
+                 poll_failures: int = 0, truncate_downloads: bool = False):
+        self.ocr_handler = ocr_handler
+        self.polls_until_done = polls_until_done
+        # 前 poll_failures 次查询任务返回 503，模拟临时故障
+        self.poll_failures = poll_failures
+        # 下载文件时只发送一半内容后断开连接，模拟读取中途的网络错误
+        self.truncate_downloads = truncate_downloads
+        self.files = {}  # file_id -> bytes
+        self.jobs = {}  # job_id -> dict
+        self.lock = threading.RLock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_file(self, content: bytes) -> str:
+        file_id = str(uuid.uuid4())
+        with self.lock:
+            self.files[file_id] = content
+        return file_id
+
+    def _finish_job(self, job: dict) -> None:
+        output, errors = [], []
+        for file_id in job["input_files"]:
+            for line in self.files[file_id].decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                status_code, body = self.ocr_handler(request["custom_id"], request["body"])
+                record = {
+                    "id": str(uuid.uuid4()),
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": status_code, "body": body},
+                    "error": None,
+                }
+                (output if status_code == 200 else errors).append(record)
+
+        def store(records):
+            if not records:
+                return None
+            return self.add_file("".join(json.dumps(r) + "\n" for r in records).encode('utf-8'))
+
+        job.update(
+            status="SUCCESS",
+            output_file=store(output),
+            error_file=store(errors),
+            completed_requests=len(output) + len(errors),
+            succeeded_requests=len(output),
+            failed_requests=len(errors),
+        )
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def do_POST(self):
+                if self.path == '/v1/files':
+                    header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                    message = BytesParser(policy=HTTP).parsebytes(header + self._read_body())
+                    part = next(
+                        p for p in message.iter_parts()
+                        if p.get_param('name', header='content-disposition') == 'file'
+                    )
+                    content = part.get_payload(decode=True)
+                    file_id = fake.add_file(content)
+                    self._send_json(200, {
+                        "id": file_id,
+                        "object": "file",
+                        "size_bytes": len(content),
+                        "created_at": int(time.time()),
+                        "filename": part.get_filename() or "upload",
+                        "purpose": "batch",
+                        "sample_type": "batch_request",
+                        "source": "upload",
+                    })
+                elif self.path == '/v1/batch/jobs':
+                    request = json.loads(self._read_body())
+                    job = {
+                        "id": str(uuid.uuid4()),
+                        "object": "batch",
+                        "input_files": request["input_files"],
+                        "endpoint": request["endpoint"],
+                        "model": request.get("model"),
+                        "errors": [],
+                        "status": "QUEUED",
+                        "created_at": int(time.time()),
+                        "total_requests": 0,
+                        "completed_requests": 0,
+                        "succeeded_requests": 0,
+                        "failed_requests": 0,
+                        "polls": 0,
+                    }
+                    with fake.lock:
+                        fake.jobs[job["id"]] = job
+                    self._send_json(200, job)
+                else:
+                    self._send_json(404, {"message": "not found"})
+
+            def do_GET(self):
+                if m := re.fullmatch(r'/v1/batch/jobs/([^/?]+)', self.path.split('?')[0]):
+                    with fake.lock:
+                        if fake.poll_failures > 0:
+                            fake.poll_failures -= 1
+                            self._send_json(503, {"message": "service unavailable"})
+                            return
+                        job = fake.jobs.get(m.group(1))
+                        if not job:
+                            self._send_json(404, {"message": "job not found"})
+                            return
+                        job["polls"] += 1
+                        if job["status"] == "QUEUED":
+                            job["status"] = "RUNNING"
+                        if job["polls"] >= fake.polls_until_done and job["status"] == "RUNNING":
+                            fake._finish_job(job)
+                    self._send_json(200, job)
+                elif m := re.fullmatch(r'/v1/files/([^/]+)/content', self.path):
+                    content = fake.files.get(m.group(1))
+                    if content is None:
+                        self._send_json(404, {"message": "file not found"})
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    if fake.truncate_downloads:
+                        self.wfile.write(content[:len(content) // 2])
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                    self.wfile.write(content)
+                else:
+                    self._send_json(404, {"message": "not found"})
+
+        return Handler
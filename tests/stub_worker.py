@@ -0,0 +1,25 @@
+"""以 OCR 替身启动 ocr_worker，供分布式模式测试使用。
+
+STUB_OCR_DELAY 控制每个文件的“处理”耗时（秒）。
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ocr_worker  # noqa: E402
+
+
+def fake_process_document(file_path, output_dir=None):
+    time.sleep(float(os.environ.get("STUB_OCR_DELAY", 0)))
+    os.makedirs(output_dir, exist_ok=True)
+    stem = Path(file_path).stem
+    with open(os.path.join(output_dir, f"{stem}.md"), "w", encoding="utf-8") as f:
+        f.write(f"# {stem} (pid {os.getpid()})")
+
+
+if __name__ == "__main__":
+    ocr_worker.process_document = fake_process_document
+    ocr_worker.main()
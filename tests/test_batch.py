@@ -0,0 +1,102 @@
+import sys
+import time
+
+import pytest
+
+import pdf_ocr
+from pdf_ocr import OCRProcessingError, process_directory_batch
+from fake_mistral import FakeMistralServer, default_ocr_handler
+
+
+def ocr_handler(custom_id, body):
+    if custom_id == "rejected.png":
+        return 400, {"message": "invalid image"}
+    if custom_id == "malformed.png":
+        return 200, {"pages": "not-a-list"}
+    return default_ocr_handler(custom_id, body)
+
+
+@pytest.fixture
+def docs(tmp_path):
+    src = tmp_path / "docs"
+    src.mkdir()
+    for name in ["a.pdf", "a.png", "b.jpg", "rejected.png", "malformed.png"]:
+        (src / name).write_bytes(b"fake-" + name.encode())
+    (src / "notes.txt").write_text("ignored")
+    return src
+
+
+@pytest.fixture
+def fake_env(monkeypatch):
+    def start(**kwargs):
+        server = FakeMistralServer(ocr_handler=ocr_handler, **kwargs)
+        monkeypatch.setenv("MISTRAL_API_KEY", "test-key")
+        monkeypatch.setenv("MISTRAL_SERVER_URL", server.url)
+        return server
+    return start
+
+
+def run_batch(src, out, **kwargs):
+    return process_directory_batch(str(src), str(out), poll_interval=0.01, max_poll_interval=0.01, **kwargs)
+
+
+def test_batch_fans_out_results_and_errors(docs, tmp_path, fake_env):
+    out = tmp_path / "out"
+    with fake_env(poll_failures=2) as fake:
+        results = run_batch(docs, out)
+
+    assert len(fake.jobs) == 1
+    assert set(results) == {"a.pdf", "a.png", "b.jpg", "rejected.png", "malformed.png"}
+    assert results["a.pdf"] is None and results["a.png"] is None and results["b.jpg"] is None
+    assert "invalid image" in results["rejected.png"]
+    assert results["malformed.png"].startswith("保存OCR结果失败")
+
+    # a.pdf 与 a.png 主文件名相同，按完整文件名分开保存
+    assert (out / "ocr_results_a.pdf" / "a.pdf.md").read_text(encoding="utf-8") == "# a.pdf"
+    assert (out / "ocr_results_a.png" / "a.png.md").read_text(encoding="utf-8") == "# a.png"
+    assert (out / "ocr_results_b" / "b.md").read_text(encoding="utf-8") == "# b.jpg"
+
+
+def test_batch_resumes_existing_job(docs, tmp_path, fake_env):
+    with fake_env() as fake:
+        client = pdf_ocr._create_client()
+        job = pdf_ocr._submit_batch_job(client, sorted(docs.iterdir()))
+        results = run_batch(docs, tmp_path / "out", job_id=job.id)
+
+    assert len(fake.jobs) == 1
+    assert results["b.jpg"] is None
+
+
+def test_batch_poll_gives_up_on_permanent_error(docs, tmp_path, fake_env):
+    with fake_env():
+        with pytest.raises(OCRProcessingError, match="--job-id missing-job"):
+            run_batch(docs, tmp_path / "out", job_id="missing-job")
+
+
+def test_batch_without_result_files_raises(docs, tmp_path, fake_env):
+    with fake_env() as fake:
+        fake.jobs["failed-job"] = {
+            "id": "failed-job", "object": "batch", "input_files": [], "endpoint": "/v1/ocr",
+            "errors": [], "status": "FAILED", "created_at": int(time.time()),
+            "total_requests": 0, "completed_requests": 0, "succeeded_requests": 0,
+            "failed_requests": 0, "polls": 0, "output_file": None, "error_file": None,
+        }
+        with pytest.raises(OCRProcessingError, match="未返回结果文件"):
+            run_batch(docs, tmp_path / "out", job_id="failed-job")
+
+
+def test_batch_read_error_is_wrapped_with_resume_hint(docs, tmp_path, fake_env):
+    with fake_env(truncate_downloads=True) as fake:
+        with pytest.raises(OCRProcessingError) as exc:
+            run_batch(docs, tmp_path / "out")
+        job_id = next(iter(fake.jobs))
+    assert str(exc.value).startswith(f"读取批处理任务 {job_id}")
+    assert f"--job-id {job_id}" in str(exc.value)
+
+
+def test_job_id_requires_batch(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["pdf_ocr.py", "docs", "--job-id", "abc"])
+    with pytest.raises(SystemExit) as exc:
+        pdf_ocr.main()
+    assert exc.value.code == 2
+    assert "--batch" in capsys.readouterr().err
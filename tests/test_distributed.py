@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zipfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+TESTS = Path(__file__).resolve().parent
+TOKEN = "test-token"
+LEASE_TIMEOUT = 2
+MAX_RETRIES = 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until(predicate, timeout=30, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(interval)
+    raise AssertionError("等待超时")
+
+
+@pytest.fixture
+def coordinator():
+    port = free_port()
+    env = dict(os.environ, OCR_DISTRIBUTED="1", OCR_WORKER_TOKEN=TOKEN,
+               OCR_LEASE_TIMEOUT=str(LEASE_TIMEOUT), OCR_MAX_RETRIES=str(MAX_RETRIES))
+    proc = subprocess.Popen(
+        [sys.executable, "-c", f"import webui; webui.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+
+    def ready():
+        try:
+            urllib.request.urlopen(url + "/", timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    try:
+        wait_until(ready)
+        yield url
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@pytest.fixture
+def start_worker(coordinator):
+    procs = []
+
+    def start(delay):
+        env = dict(os.environ, OCR_WORKER_TOKEN=TOKEN, STUB_OCR_DELAY=str(delay))
+        proc = subprocess.Popen(
+            [sys.executable, str(TESTS / "stub_worker.py"), "--coordinator", coordinator,
+             "-c", "1", "--poll-interval", "0.1"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        procs.append(proc)
+        return proc
+
+    yield start
+    for proc in procs:
+        proc.kill()
+        proc.wait()
+
+
+def upload(url, names):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name in names:
+        body.write(f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; "
+                   f"filename=\"{name}\"\r\nContent-Type: application/pdf\r\n\r\n".encode())
+        body.write(b"%PDF-1.4 fake\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    req = urllib.request.Request(url + "/upload", data=body.getvalue(), method="POST",
+                                 headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(req) as resp:
+        return json.load(resp)["task_id"]
+
+
+def progress(url, task_id):
+    with urllib.request.urlopen(f"{url}/progress/{task_id}") as resp:
+        for line in resp:
+            if line.startswith(b"data: "):
+                return json.loads(line[len(b"data: "):])
+
+
+def test_worker_endpoints_require_token(coordinator):
+    req = urllib.request.Request(coordinator + "/worker/lease", method="POST")
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        urllib.request.urlopen(req)
+    assert exc.value.code == 401
+
+
+def test_coordinator_refuses_to_start_without_token():
+    env = dict(os.environ, OCR_DISTRIBUTED="1")
+    env.pop("OCR_WORKER_TOKEN", None)
+    result = subprocess.run([sys.executable, "-c", "import webui"], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "OCR_WORKER_TOKEN" in result.stderr
+
+
+def test_dead_worker_lease_is_requeued_and_finished_by_others(coordinator, start_worker):
+    names = ["a.pdf", "b.pdf", "c.pdf"]
+    task_id = upload(coordinator, names)
+
+    # 第一个 worker 领取后长时间不返回，在租约期间将其杀死
+    victim = start_worker(delay=60)
+    wait_until(lambda: any(f["status"] == "processing" for f in progress(coordinator, task_id)["files"]))
+    victim.kill()
+    victim.wait()
+
+    # 健康 worker 的处理耗时超过租约时长，依靠心跳续约
+    start_worker(delay=LEASE_TIMEOUT * 1.5)
+    start_worker(delay=LEASE_TIMEOUT * 1.5)
+
+    data = wait_until(
+        lambda: (d := progress(coordinator, task_id))["status"] in ("completed", "failed") and d,
+        timeout=60,
+    )
+    assert data["status"] == "completed"
+    assert data["progress"] == {"completed": 3, "failed": 0, "total": 3, "percent": 100}
+
+    with urllib.request.urlopen(f"{coordinator}/download/{task_id}") as resp:
+        archive = zipfile.ZipFile(io.BytesIO(resp.read()))
+    md_files = sorted(n for n in archive.namelist() if n.endswith(".md"))
+    assert md_files == [f"ocr_results_{Path(n).stem}/{Path(n).stem}.md" for n in names]
+    pids = {archive.read(n).decode().rsplit("pid ", 1)[1].rstrip(")") for n in md_files}
+    assert str(victim.pid) not in pids
+
+
+def test_coordinator_reports_inactive_limiter(coordinator):
+    with urllib.request.urlopen(coordinator + "/concurrency") as resp:
+        assert json.load(resp)["active"] is False
+
+
+def worker_call(url, path, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url + path, data=data, method="POST", headers={
+        "Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json",
+    })
+    with urllib.request.urlopen(req) as resp:
+        return json.load(resp) if resp.status == 200 else None
+
+
+def test_transient_failures_are_requeued_until_retry_limit(coordinator):
+    task_id = upload(coordinator, ["a.pdf"])
+
+    for _ in range(MAX_RETRIES):
+        lease = worker_call(coordinator, "/worker/lease")
+        worker_call(coordinator, f"/worker/fail/{lease['lease_id']}", {"error": "HTTP 503", "retry": True})
+        assert progress(coordinator, task_id)["files"][0]["status"] == "pending"
+
+    lease = worker_call(coordinator, "/worker/lease")
+    worker_call(coordinator, f"/worker/fail/{lease['lease_id']}", {"error": "HTTP 503", "retry": True})
+    data = progress(coordinator, task_id)
+    assert data["status"] == "failed"
+    assert data["files"][0]["error"] == "HTTP 503"
+
+
+def test_permanent_failure_is_not_requeued(coordinator):
+    task_id = upload(coordinator, ["a.pdf"])
+    lease = worker_call(coordinator, "/worker/lease")
+    worker_call(coordinator, f"/worker/fail/{lease['lease_id']}", {"error": "HTTP 401", "retry": False})
+
+    assert progress(coordinator, task_id)["files"][0]["status"] == "failed"
+    assert worker_call(coordinator, "/worker/lease") is None
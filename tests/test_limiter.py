@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from pdf_ocr import AdaptiveConcurrencyLimiter, OCRProcessingError
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class NetworkError(Exception):
+    """与 httpx 传输层异常同名"""
+
+
+def make_limiter(**kwargs):
+    kwargs.setdefault("cooldown", 0)
+    kwargs.setdefault("warmup", 3)
+    return AdaptiveConcurrencyLimiter(min_limit=1, max_limit=10, initial_limit=4, **kwargs)
+
+
+def call(limiter, error=None, size_mb=1.0, latency=1.0):
+    limiter.acquire()
+    limiter.release(latency, error, size_mb)
+
+
+def saturated_call(limiter, error=None, size_mb=1.0, latency=1.0):
+    """名额用满时完成一次调用"""
+    for _ in range(limiter.limit):
+        limiter.acquire()
+    limiter.release(latency, error, size_mb)
+    for _ in range(limiter.snapshot()["in_flight"]):
+        limiter.abandon()
+
+
+def test_successes_grow_limit_additively_up_to_max():
+    limiter = make_limiter()
+    for _ in range(5):
+        saturated_call(limiter)
+    assert limiter.limit == 5
+    for _ in range(200):
+        saturated_call(limiter)
+    assert limiter.limit == 10
+    assert limiter.snapshot()["decisions"][-1]["action"] == "increase"
+
+
+def test_unsaturated_successes_do_not_grow_limit():
+    limiter = make_limiter()
+    for _ in range(300):
+        call(limiter)
+    assert limiter.limit == 4
+    assert limiter.snapshot()["decisions"] == []
+
+
+@pytest.mark.parametrize("error", [
+    HTTPError(429),
+    HTTPError(503),
+    NetworkError("connection reset"),
+    TimeoutError("timed out"),
+    ConnectionResetError("reset"),
+])
+def test_overload_signals_halve_limit(error):
+    limiter = make_limiter()
+    call(limiter, error)
+    assert limiter.limit == 2
+    assert limiter.snapshot()["decisions"][-1]["action"] == "decrease"
+
+
+def test_wrapped_errors_are_classified_by_root_cause():
+    limiter = make_limiter()
+    try:
+        try:
+            raise HTTPError(502)
+        except HTTPError as e:
+            raise OCRProcessingError("wrapped") from e
+    except OCRProcessingError as e:
+        call(limiter, e)
+    assert limiter.limit == 2
+
+
+@pytest.mark.parametrize("error", [HTTPError(401), HTTPError(400), ValueError("bad input")])
+def test_other_failures_leave_limit_unchanged(error):
+    limiter = make_limiter()
+    for _ in range(10):
+        call(limiter, error)
+    assert limiter.limit == 4
+    assert limiter.snapshot()["decisions"] == []
+
+
+def test_slot_never_increases_on_exception():
+    limiter = make_limiter()
+    for _ in range(10):
+        with pytest.raises(NetworkError):
+            with limiter.slot():
+                raise NetworkError("no response")
+    assert limiter.limit == 1
+
+
+def test_latency_is_normalised_by_size():
+    limiter = make_limiter()
+    for _ in range(4):
+        saturated_call(limiter, latency=2.0, size_mb=1.0)
+    # 大文件耗时长但单位耗时正常，不应视为过载
+    saturated_call(limiter, latency=40.0, size_mb=20.0)
+    assert limiter.limit == 5
+    # 单位耗时远超基线
+    call(limiter, latency=20.0, size_mb=1.0)
+    assert limiter.limit == 2
+    assert "基线" in limiter.snapshot()["decisions"][-1]["reason"]
+
+
+def test_no_latency_decrease_during_warmup():
+    limiter = make_limiter()
+    call(limiter, latency=1.0)
+    call(limiter, latency=100.0)
+    assert limiter.limit == 4
+
+
+def test_cooldown_limits_consecutive_decreases():
+    limiter = make_limiter(cooldown=60)
+    call(limiter, HTTPError(429))
+    call(limiter, HTTPError(429))
+    assert limiter.limit == 2
+
+
+def test_acquire_blocks_at_limit_and_abandon_frees_slot():
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, initial_limit=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def waiter():
+        limiter.acquire()
+        acquired.set()
+
+    threading.Thread(target=waiter, daemon=True).start()
+    assert not acquired.wait(0.1)
+    limiter.abandon()
+    assert acquired.wait(1)
+    assert limiter.snapshot()["decisions"] == []
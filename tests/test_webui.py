@@ -0,0 +1,80 @@
+import threading
+
+from webui import FileStatus, TaskInfo
+
+
+def make_task(n=3, work_dir="/tmp/w"):
+    return TaskInfo(
+        "t", work_dir,
+        [f"f{i}.pdf" for i in range(n)],
+        [f"{work_dir}/f{i}.pdf" for i in range(n)],
+        [f"{work_dir}/o{i}" for i in range(n)],
+    )
+
+
+def test_counters_track_transitions():
+    task = make_task()
+    with task.lock:
+        task.set_file_status(0, FileStatus.PROCESSING)
+        task.set_file_status(0, FileStatus.COMPLETED, output_dir="/tmp/w/o0")
+        task.set_file_status(1, FileStatus.FAILED, error="boom")
+        assert not task.all_done()
+        task.set_file_status(2, FileStatus.CANCELLED)
+        assert task.all_done()
+
+    data = task.to_dict()
+    assert data["progress"] == {"completed": 1, "failed": 1, "total": 3, "percent": 66}
+    assert [f["status"] for f in data["files"]] == ["completed", "failed", "cancelled"]
+    assert data["files"][1]["error"] == "boom"
+
+
+def test_snapshots_are_independent_of_later_transitions():
+    task = make_task()
+    first = task.to_dict()["files"]
+
+    with task.lock:
+        task.set_file_status(1, FileStatus.FAILED, error="boom")
+        task.set_file_status(1, FileStatus.PENDING)
+    second = task.to_dict()["files"]
+
+    assert first[1] == {"name": "f1.pdf", "status": "pending", "error": None, "output_dir": None}
+    assert second[1]["error"] is None
+    assert task.file_indices(FileStatus.PENDING) == [0, 1, 2]
+
+
+def test_files_waiting_for_a_slot_stay_pending_and_honour_pause(monkeypatch, tmp_path):
+    import webui
+    from pdf_ocr import AdaptiveConcurrencyLimiter
+
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, initial_limit=1)
+    monkeypatch.setattr(webui, "limiter", limiter)
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fake_process_document(file_path, output_dir):
+        started.set()
+        finish.wait(5)
+
+    monkeypatch.setattr(webui, "process_document", fake_process_document)
+    task = make_task(2, str(tmp_path))
+    for path in task.file_paths:
+        open(path, "wb").write(b"x")
+    monkeypatch.setitem(webui.tasks, "gate", task)
+
+    first = threading.Thread(target=webui.process_single_file, args=("gate", 0, task.file_paths[0], task.out_dirs[0]))
+    second = threading.Thread(target=webui.process_single_file, args=("gate", 1, task.file_paths[1], task.out_dirs[1]))
+    first.start()
+    assert started.wait(5)
+    second.start()
+    second.join(0.2)
+    assert task.file_status(1) == FileStatus.PENDING
+
+    with task.lock:
+        task.status = webui.TaskStatus.PAUSED
+    finish.set()
+    first.join(5)
+    second.join(5)
+
+    assert task.file_status(0) == FileStatus.COMPLETED
+    assert task.file_status(1) == FileStatus.CANCELLED
+    assert limiter.snapshot()["in_flight"] == 0
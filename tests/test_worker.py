@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import ocr_worker
+from pdf_ocr import AdaptiveConcurrencyLimiter, OCRProcessingError
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeClient:
+    def __init__(self, jobs=()):
+        self.jobs = list(jobs)
+        self.lease_calls = 0
+        self.failures = []
+        self.results = []
+
+    def lease(self):
+        self.lease_calls += 1
+        return self.jobs.pop(0) if self.jobs else None
+
+    def download(self, lease_id, dest_path):
+        with open(dest_path, "wb") as f:
+            f.write(b"%PDF fake")
+
+    def heartbeat(self, lease_id):
+        pass
+
+    def upload_result(self, lease_id, zip_path):
+        self.results.append(lease_id)
+
+    def report_failure(self, lease_id, error, retry=False):
+        self.failures.append((lease_id, error, retry))
+
+
+def job(lease_id="L1"):
+    return {"lease_id": lease_id, "file_name": "a.pdf", "lease_timeout": 60}
+
+
+def test_worker_waits_for_capacity_before_leasing():
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, initial_limit=1)
+    client = FakeClient()
+    limiter.acquire()
+    threading.Thread(target=ocr_worker.worker_loop, args=(client, limiter, 0.01), daemon=True).start()
+
+    time.sleep(0.2)
+    assert client.lease_calls == 0
+    limiter.abandon()
+    time.sleep(0.2)
+    assert client.lease_calls > 0
+    assert limiter.snapshot()["in_flight"] <= 1
+
+
+@pytest.mark.parametrize("error, retry", [
+    (HTTPError(503), True),
+    (HTTPError(429), True),
+    (ConnectionResetError("reset"), True),
+    (HTTPError(401), False),
+    (ValueError("不支持的文件类型"), False),
+])
+def test_transient_errors_ask_coordinator_to_requeue(monkeypatch, error, retry):
+    def fake_process_document(file_path, output_dir=None):
+        try:
+            raise error
+        except Exception as e:
+            if isinstance(e, ValueError):
+                raise
+            raise OCRProcessingError(f"OCR处理过程中发生API或连接错误: {e}") from e
+
+    monkeypatch.setattr(ocr_worker, "process_document", fake_process_document)
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=2, initial_limit=2)
+    client = FakeClient()
+    limiter.acquire()
+    ocr_worker.run_job(client, job(), limiter)
+
+    assert client.failures == [("L1", str(error) if isinstance(error, ValueError) else
+                                f"OCR处理过程中发生API或连接错误: {error}", retry)]
+    assert limiter.snapshot()["in_flight"] == 0
+
+
+def test_slot_is_returned_when_job_payload_is_malformed():
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, initial_limit=1)
+    limiter.acquire()
+    with pytest.raises(KeyError):
+        ocr_worker.run_job(FakeClient(), {"file_name": "a.pdf"}, limiter)
+    assert limiter.snapshot()["in_flight"] == 0
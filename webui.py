@@ -4,13 +4,19 @@ import zipfile
 import shutil
 import uuid
 import json
+import hmac
 import threading
+import time
+from collections import deque
+from functools import wraps
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, Future
 from flask import Flask, request, render_template_string, send_file, Response, jsonify
 from werkzeug.utils import secure_filename
 
-from pdf_ocr import process_document, OCRProcessingError, is_supported_file
+from pdf_ocr import (
+    process_document, OCRProcessingError, is_supported_file, file_size_mb, AdaptiveConcurrencyLimiter
+)
 
 app = Flask(__name__)
 
@@ -18,8 +24,31 @@ app = Flask(__name__)
 tasks = {}  # task_id -> TaskInfo
 tasks_lock = threading.Lock()
 
-# 并发处理器（最多5个并发）
-executor = ThreadPoolExecutor(max_workers=5)
+# 自适应并发控制：根据 API 时延与 429/5xx 比例在上下限之间自动调整同时处理的文件数
+limiter = AdaptiveConcurrencyLimiter(
+    min_limit=int(os.environ.get("OCR_MIN_CONCURRENCY", 1)),
+    max_limit=int(os.environ.get("OCR_MAX_CONCURRENCY", 20)),
+    initial_limit=int(os.environ.get("OCR_INITIAL_CONCURRENCY", 5)),
+    latency_tolerance=float(os.environ.get("OCR_LATENCY_TOLERANCE", 3)),
+)
+
+# 线程池按上限配置，文件在获得 limiter 名额后才开始处理
+executor = ThreadPoolExecutor(max_workers=limiter.max_limit)
+
+# 分布式模式：本进程只做协调，OCR 由远程 ocr_worker.py 通过 HTTP 租约领取
+DISTRIBUTED = os.environ.get("OCR_DISTRIBUTED") == "1"
+WORKER_TOKEN = os.environ.get("OCR_WORKER_TOKEN")
+LEASE_TIMEOUT = float(os.environ.get("OCR_LEASE_TIMEOUT", 60))
+# worker 报告临时错误后文件最多重新排队的次数
+MAX_RETRIES = int(os.environ.get("OCR_MAX_RETRIES", 3))
+
+# worker 接口可下载用户上传的文档，分布式模式必须配置令牌
+if DISTRIBUTED and not WORKER_TOKEN:
+    raise RuntimeError("分布式模式（OCR_DISTRIBUTED=1）必须设置 OCR_WORKER_TOKEN。")
+
+job_queue = deque()  # (task_id, file_index)
+leases = {}  # lease_id -> Lease
+jobs_lock = threading.Lock()
 
 
 class FileStatus:
@@ -38,31 +67,100 @@ class TaskStatus:
     FAILED = "failed"
 
 
+# 文件状态在 TaskInfo 中以单字节编码存储
+FILE_STATUSES = (
+    FileStatus.PENDING, FileStatus.PROCESSING, FileStatus.COMPLETED, FileStatus.FAILED, FileStatus.CANCELLED
+)
+FILE_STATUS_CODES = {status: code for code, status in enumerate(FILE_STATUSES)}
+
+
 class TaskInfo:
-    def __init__(self, task_id: str, work_dir: str, files: list):
+    """任务状态。
+
+    文件信息按下标存放在紧凑数组中：名称与路径创建后不再改变，状态为
+    bytearray，错误信息和输出目录只为少数文件存在，放在稀疏字典里。
+    """
+
+    def __init__(self, task_id: str, work_dir: str, names: list[str], file_paths: list[str], out_dirs: list[str]):
         self.task_id = task_id
         self.work_dir = work_dir
         self.status = TaskStatus.RUNNING
-        self.files = files  # [{"name": str, "status": str, "error": str|None, "output_dir": str|None}]
+        self.names = tuple(names)
+        self.file_paths = tuple(file_paths)
+        self.out_dirs = tuple(out_dirs)
         self.futures: list[Future] = []
         self.lock = threading.Lock()
+        self._statuses = bytearray(len(names))  # 全部为 PENDING（编码 0）
+        self._errors = {}  # file_index -> str
+        self._output_dirs = {}  # file_index -> str
+        self.retries = {}  # file_index -> 因临时错误重新排队的次数
+        # 各状态的文件计数，随状态变化增量更新
+        self.counts = dict.fromkeys(FILE_STATUSES, 0)
+        self.counts[FileStatus.PENDING] = len(names)
+
+    @property
+    def total(self) -> int:
+        return len(self.names)
+
+    def file_status(self, index: int) -> str:
+        """调用方需持有 self.lock"""
+        return FILE_STATUSES[self._statuses[index]]
+
+    def file_indices(self, status: str) -> list[int]:
+        """处于指定状态的文件下标，调用方需持有 self.lock"""
+        code = FILE_STATUS_CODES[status]
+        return [i for i, c in enumerate(self._statuses) if c == code]
+
+    def output_dir(self, index: int):
+        """调用方需持有 self.lock"""
+        return self._output_dirs.get(index)
+
+    def set_file_status(self, index: int, status: str, error: str = None, output_dir: str = None):
+        """更新文件状态，调用方需持有 self.lock"""
+        self.counts[FILE_STATUSES[self._statuses[index]]] -= 1
+        self.counts[status] += 1
+        self._statuses[index] = FILE_STATUS_CODES[status]
+        if error is None:
+            self._errors.pop(index, None)
+        else:
+            self._errors[index] = error
+        if output_dir is not None:
+            self._output_dirs[index] = output_dir
+
+    def all_done(self) -> bool:
+        """调用方需持有 self.lock"""
+        return self.counts[FileStatus.PENDING] == 0 and self.counts[FileStatus.PROCESSING] == 0
 
     def to_dict(self):
+        # 锁内只复制紧凑状态，逐文件的字典在锁外构建
         with self.lock:
-            completed = sum(1 for f in self.files if f["status"] == FileStatus.COMPLETED)
-            failed = sum(1 for f in self.files if f["status"] == FileStatus.FAILED)
-            total = len(self.files)
-            return {
-                "task_id": self.task_id,
-                "status": self.status,
-                "files": self.files.copy(),
-                "progress": {
-                    "completed": completed,
-                    "failed": failed,
-                    "total": total,
-                    "percent": int((completed + failed) / total * 100) if total > 0 else 0
+            status = self.status
+            statuses = bytes(self._statuses)
+            errors = dict(self._errors)
+            output_dirs = dict(self._output_dirs)
+            completed = self.counts[FileStatus.COMPLETED]
+            failed = self.counts[FileStatus.FAILED]
+
+        total = self.total
+        return {
+            "task_id": self.task_id,
+            "status": status,
+            "files": [
+                {
+                    "name": name,
+                    "status": FILE_STATUSES[code],
+                    "error": errors.get(i),
+                    "output_dir": output_dirs.get(i),
                 }
+                for i, (name, code) in enumerate(zip(self.names, statuses))
+            ],
+            "progress": {
+                "completed": completed,
+                "failed": failed,
+                "total": total,
+                "percent": int((completed + failed) / total * 100) if total > 0 else 0
             }
+        }
 
 
 def process_single_file(task_id: str, file_index: int, file_path: str, output_dir: str):
@@ -72,26 +170,40 @@ def process_single_file(task_id: str, file_index: int, file_path: str, output_di
         if not task:
             return
 
-    # 检查任务是否被暂停或取消
+    # 等待并发名额，文件在此期间保持等待中状态
+    limiter.acquire()
+
+    # 拿到名额后再检查任务是否被暂停或取消，以及文件是否已被其他提交处理
     with task.lock:
+        if task.file_status(file_index) != FileStatus.PENDING:
+            limiter.abandon()
+            return
         if task.status in [TaskStatus.PAUSED, TaskStatus.CANCELLED]:
-            task.files[file_index]["status"] = FileStatus.CANCELLED
+            task.set_file_status(file_index, FileStatus.CANCELLED)
+            limiter.abandon()
             return
-        task.files[file_index]["status"] = FileStatus.PROCESSING
+        task.set_file_status(file_index, FileStatus.PROCESSING)
 
+    start = time.monotonic()
+    error = None
     try:
         process_document(file_path, output_dir)
         with task.lock:
-            task.files[file_index]["status"] = FileStatus.COMPLETED
-            task.files[file_index]["output_dir"] = output_dir
+            task.set_file_status(file_index, FileStatus.COMPLETED, output_dir=output_dir)
     except (FileNotFoundError, ValueError, OCRProcessingError) as e:
+        error = e
         with task.lock:
-            task.files[file_index]["status"] = FileStatus.FAILED
-            task.files[file_index]["error"] = str(e)
+            task.set_file_status(file_index, FileStatus.FAILED, error=str(e))
     except Exception as e:
+        error = e
         with task.lock:
-            task.files[file_index]["status"] = FileStatus.FAILED
-            task.files[file_index]["error"] = f"未知错误: {e}"
+            task.set_file_status(file_index, FileStatus.FAILED, error=f"未知错误: {e}")
+    finally:
+        try:
+            size_mb = file_size_mb(file_path)
+        except OSError:
+            size_mb = 1.0
+        limiter.release(time.monotonic() - start, error, size_mb)
 
 
 def check_task_completion(task_id: str):
@@ -105,15 +217,110 @@ def check_task_completion(task_id: str):
         if task.status in [TaskStatus.PAUSED, TaskStatus.CANCELLED]:
             return
 
-        all_done = all(
-            f["status"] in [FileStatus.COMPLETED, FileStatus.FAILED, FileStatus.CANCELLED]
-            for f in task.files
-        )
-        if all_done:
-            has_failed = any(f["status"] == FileStatus.FAILED for f in task.files)
+        if task.all_done():
+            has_failed = task.counts[FileStatus.FAILED] > 0
             task.status = TaskStatus.FAILED if has_failed else TaskStatus.COMPLETED
 
 
+def dispatch_file(task: TaskInfo, file_index: int):
+    """提交单个文件：分布式模式下进入租约队列，否则交给本地线程池"""
+    if DISTRIBUTED:
+        with jobs_lock:
+            job_queue.append((task.task_id, file_index))
+        return
+
+    future = executor.submit(
+        process_single_file, task.task_id, file_index, task.file_paths[file_index], task.out_dirs[file_index]
+    )
+    future.add_done_callback(lambda _, tid=task.task_id: check_task_completion(tid))
+    task.futures.append(future)
+
+
+class Lease:
+    """远程 worker 对单个文件的租约"""
+    __slots__ = ("task_id", "file_index", "expires_at")
+
+    def __init__(self, task_id: str, file_index: int):
+        self.task_id = task_id
+        self.file_index = file_index
+        self.expires_at = time.monotonic() + LEASE_TIMEOUT
+
+
+def lease_job():
+    """从队列中取出下一个待处理文件并创建租约，队列为空时返回 None"""
+    while True:
+        with jobs_lock:
+            if not job_queue:
+                return None
+            task_id, file_index = job_queue.popleft()
+
+        with tasks_lock:
+            task = tasks.get(task_id)
+        if not task:
+            continue
+
+        with task.lock:
+            if task.file_status(file_index) != FileStatus.PENDING:
+                continue
+            if task.status in [TaskStatus.PAUSED, TaskStatus.CANCELLED]:
+                task.set_file_status(file_index, FileStatus.CANCELLED)
+                continue
+            task.set_file_status(file_index, FileStatus.PROCESSING)
+
+        lease_id = str(uuid.uuid4())
+        with jobs_lock:
+            leases[lease_id] = Lease(task_id, file_index)
+        return lease_id, task, file_index
+
+
+def release_lease(lease_id: str):
+    """结束租约并返回 (task, file_index)，租约不存在或已过期时返回 None"""
+    with jobs_lock:
+        lease = leases.pop(lease_id, None)
+    if not lease:
+        return None
+    with tasks_lock:
+        task = tasks.get(lease.task_id)
+    if not task:
+        return None
+    return task, lease.file_index
+
+
+def requeue_file(task: TaskInfo, file_index: int):
+    """将处理中的文件放回队列，暂停或取消的任务则标记为取消，调用方需持有 task.lock"""
+    if task.status == TaskStatus.RUNNING:
+        task.set_file_status(file_index, FileStatus.PENDING)
+        dispatch_file(task, file_index)
+    else:
+        task.set_file_status(file_index, FileStatus.CANCELLED)
+
+
+def reap_expired_leases():
+    """回收过期租约：文件重新排队，暂停或取消的任务则标记为取消"""
+    now = time.monotonic()
+    with jobs_lock:
+        expired = [lid for lid, lease in leases.items() if lease.expires_at <= now]
+    for lease_id in expired:
+        released = release_lease(lease_id)
+        if not released:
+            continue
+        task, file_index = released
+        with task.lock:
+            if task.file_status(file_index) != FileStatus.PROCESSING:
+                continue
+            requeue_file(task, file_index)
+        check_task_completion(task.task_id)
+
+
+def _lease_reaper_loop():
+    while True:
+        time.sleep(LEASE_TIMEOUT / 4)
+        reap_expired_leases()
+
+
+if DISTRIBUTED:
+    threading.Thread(target=_lease_reaper_loop, daemon=True).start()
+
 
 HTML_TEMPLATE = """
 <!doctype html>
@@ -143,7 +350,7 @@ HTML_TEMPLATE = """
       <div class="mb-3">
         <input type="file" class="form-control" id="file-input" name="files" multiple
                accept=".pdf,.png,.jpg,.jpeg,.webp,.gif,.bmp,.tiff,.tif" required>
-        <small class="text-muted">支持 PDF 与图片（PNG/JPG/WebP 等），可多选，最多同时处理 5 个</small>
+        <small class="text-muted">支持 PDF 与图片（PNG/JPG/WebP 等），可多选，并发数根据 API 状况自动调整</small>
       </div>
       <button type="submit" class="btn btn-primary" id="start-btn">开始 OCR</button>
     </form>
@@ -349,8 +556,7 @@ def upload():
     task_id = str(uuid.uuid4())
 
     # 准备文件列表
-    files_info = []
-    pending_files = []
+    names, file_paths, out_dirs = [], [], []
 
     for f in uploaded_files:
         if f.filename == '':
@@ -363,30 +569,22 @@ def upload():
         f.save(file_path)
         out_dir = os.path.join(work_dir, f'ocr_results_{Path(filename).stem}')
 
-        files_info.append({
-            "name": filename,
-            "status": FileStatus.PENDING,
-            "error": None,
-            "output_dir": None,
-            "file_path": file_path,
-            "out_dir": out_dir
-        })
-        pending_files.append((file_path, out_dir))
-
-    if not files_info:
+        names.append(filename)
+        file_paths.append(file_path)
+        out_dirs.append(out_dir)
+
+    if not names:
         shutil.rmtree(work_dir, ignore_errors=True)
         return jsonify({"error": "没有有效的 PDF 或图片文件"}), 400
 
     # 创建任务
-    task = TaskInfo(task_id, work_dir, files_info)
+    task = TaskInfo(task_id, work_dir, names, file_paths, out_dirs)
     with tasks_lock:
         tasks[task_id] = task
 
     # 提交并发任务
-    for i, (file_path, out_dir) in enumerate(pending_files):
-        future = executor.submit(process_single_file, task_id, i, file_path, out_dir)
-        future.add_done_callback(lambda _, tid=task_id: check_task_completion(tid))
-        task.futures.append(future)
+    for i in range(task.total):
+        dispatch_file(task, i)
 
     return jsonify({"task_id": task_id})
 
@@ -410,7 +608,6 @@ def progress(task_id):
             if data["status"] in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
                 break
 
-            import time
             time.sleep(0.5)  # 每0.5秒推送一次
 
     return Response(generate(), mimetype='text/event-stream',
@@ -430,9 +627,8 @@ def pause(task_id):
         if task.status == TaskStatus.RUNNING:
             task.status = TaskStatus.PAUSED
             # 将等待中的文件标记为取消
-            for f in task.files:
-                if f["status"] == FileStatus.PENDING:
-                    f["status"] = FileStatus.CANCELLED
+            for i in task.file_indices(FileStatus.PENDING):
+                task.set_file_status(i, FileStatus.CANCELLED)
 
     return jsonify({"status": "paused"})
 
@@ -450,14 +646,9 @@ def resume(task_id):
         if task.status == TaskStatus.PAUSED:
             task.status = TaskStatus.RUNNING
             # 重新提交被取消的文件
-            for i, f in enumerate(task.files):
-                if f["status"] == FileStatus.CANCELLED:
-                    f["status"] = FileStatus.PENDING
-                    future = executor.submit(
-                        process_single_file, task_id, i, f["file_path"], f["out_dir"]
-                    )
-                    future.add_done_callback(lambda _, tid=task_id: check_task_completion(tid))
-                    task.futures.append(future)
+            for i in task.file_indices(FileStatus.CANCELLED):
+                task.set_file_status(i, FileStatus.PENDING)
+                dispatch_file(task, i)
 
     return jsonify({"status": "running"})
 
@@ -474,13 +665,21 @@ def cancel(task_id):
     with task.lock:
         task.status = TaskStatus.CANCELLED
         # 将等待中的文件标记为取消
-        for f in task.files:
-            if f["status"] == FileStatus.PENDING:
-                f["status"] = FileStatus.CANCELLED
+        for i in task.file_indices(FileStatus.PENDING):
+            task.set_file_status(i, FileStatus.CANCELLED)
 
     return jsonify({"status": "cancelled"})
 
 
+@app.route('/concurrency')
+def concurrency():
+    """当前并发上限及最近的调整记录（按文件计数）"""
+    if DISTRIBUTED:
+        # 分布式模式下由各 worker 自行控制并发，本进程的控制器不参与处理
+        return jsonify({"active": False, "reason": "分布式模式下并发由各 worker 控制"})
+    return jsonify({"active": True, **limiter.snapshot()})
+
+
 @app.route('/download/<task_id>')
 def download(task_id):
     """下载已完成的结果"""
@@ -493,9 +692,9 @@ def download(task_id):
     # 收集已完成的输出目录
     completed_dirs = []
     with task.lock:
-        for f in task.files:
-            if f["status"] == FileStatus.COMPLETED and f.get("output_dir"):
-                completed_dirs.append(f["output_dir"])
+        for i in task.file_indices(FileStatus.COMPLETED):
+            if task.output_dir(i):
+                completed_dirs.append(task.output_dir(i))
 
     if not completed_dirs:
         return jsonify({"error": "没有已完成的文件"}), 400
@@ -515,5 +714,113 @@ def download(task_id):
     return send_file(zip_path, as_attachment=True, download_name=f'ocr_results_{timestamp}.zip')
 
 
+def worker_auth_required(view):
+    """worker 接口仅在分布式模式下开放，并校验请求头中的令牌"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not DISTRIBUTED:
+            return jsonify({"error": "未启用分布式模式"}), 404
+        auth = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode(), f'Bearer {WORKER_TOKEN}'.encode()):
+            return jsonify({"error": "未授权"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/worker/lease', methods=['POST'])
+@worker_auth_required
+def worker_lease():
+    """worker 领取一个待处理文件"""
+    reap_expired_leases()
+    leased = lease_job()
+    if not leased:
+        return '', 204
+
+    lease_id, task, file_index = leased
+    return jsonify({
+        "lease_id": lease_id,
+        "file_name": task.names[file_index],
+        "lease_timeout": LEASE_TIMEOUT,
+    })
+
+
+@app.route('/worker/file/<lease_id>')
+@worker_auth_required
+def worker_file(lease_id):
+    """worker 下载租约对应的源文件"""
+    with jobs_lock:
+        lease = leases.get(lease_id)
+    if not lease:
+        return jsonify({"error": "租约不存在或已过期"}), 409
+
+    with tasks_lock:
+        task = tasks.get(lease.task_id)
+    if not task:
+        return jsonify({"error": "任务不存在"}), 404
+    return send_file(task.file_paths[lease.file_index], as_attachment=True)
+
+
+@app.route('/worker/heartbeat/<lease_id>', methods=['POST'])
+@worker_auth_required
+def worker_heartbeat(lease_id):
+    """worker 续约"""
+    with jobs_lock:
+        lease = leases.get(lease_id)
+        if lease:
+            lease.expires_at = time.monotonic() + LEASE_TIMEOUT
+    if not lease:
+        return jsonify({"error": "租约不存在或已过期"}), 409
+    return jsonify({"status": "ok"})
+
+
+@app.route('/worker/result/<lease_id>', methods=['POST'])
+@worker_auth_required
+def worker_result(lease_id):
+    """worker 以 ZIP 流上传 OCR 结果"""
+    released = release_lease(lease_id)
+    if not released:
+        return jsonify({"error": "租约不存在或已过期"}), 409
+
+    task, file_index = released
+    out_dir = task.out_dirs[file_index]
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            shutil.copyfileobj(request.stream, tmp)
+            tmp.seek(0)
+            with zipfile.ZipFile(tmp) as zipf:
+                zipf.extractall(out_dir)
+    except (OSError, zipfile.BadZipFile) as e:
+        with task.lock:
+            task.set_file_status(file_index, FileStatus.FAILED, error=f"接收结果失败: {e}")
+    else:
+        with task.lock:
+            task.set_file_status(file_index, FileStatus.COMPLETED, output_dir=out_dir)
+    check_task_completion(task.task_id)
+    return jsonify({"status": "ok"})
+
+
+@app.route('/worker/fail/<lease_id>', methods=['POST'])
+@worker_auth_required
+def worker_fail(lease_id):
+    """worker 报告处理失败，retry 为真表示临时错误"""
+    released = release_lease(lease_id)
+    if not released:
+        return jsonify({"error": "租约不存在或已过期"}), 409
+
+    task, file_index = released
+    payload = request.get_json(silent=True) or {}
+    error = payload.get("error") or "未知错误"
+    with task.lock:
+        # 临时错误（429/5xx、连接问题）重新排队，超过重试次数或永久错误才判定失败
+        retries = task.retries.get(file_index, 0)
+        if payload.get("retry") and retries < MAX_RETRIES:
+            task.retries[file_index] = retries + 1
+            requeue_file(task, file_index)
+        else:
+            task.set_file_status(file_index, FileStatus.FAILED, error=error)
+    check_task_completion(task.task_id)
+    return jsonify({"status": "ok"})
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, threaded=True)
\ No newline at end of file